@@ -2,10 +2,34 @@ import os
 import time
 import shutil
 import csv
+import io
+import re
+import json
+import hashlib
+import queue
+import struct
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
 import psycopg2
 from psycopg2 import sql
+from psycopg2.extras import execute_batch, execute_values
+from psycopg2.pool import ThreadedConnectionPool
 from datetime import datetime
 import logging
+from itertools import chain
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa = pa_csv = None # Opcional: solo necesario con CSV_ENGINE=pyarrow
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None # Opcional: sin watchdog se sondea el directorio
+    FileSystemEventHandler = object
 
 # --- CONFIGURATION ---
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -14,6 +38,7 @@ PROCESSED_DIR = os.path.join(BASE_DIR, 'lims_processed')
 ERRORS_DIR = os.path.join(BASE_DIR, 'lims_errors')
 ENV_FILE = os.path.join(BASE_DIR, '.env')
 LOG_FILE = os.path.join(BASE_DIR, 'auto_lims.log')
+SCHEMA_CACHE_FILE = os.path.join(BASE_DIR, 'schema_cache.json')
 
 # Setup Logging
 logging.basicConfig(
@@ -32,7 +57,11 @@ def load_env_config():
         "DB_PORT": "5432",
         "DB_NAME": "ISP-DB", #<------------------   Database
         "DB_USER": "postgres", #<------------------   User
-        "DB_PASS": None #<------------------   Password
+        "DB_PASS": None, #<------------------   Password
+        "INSERT_METHOD": "copy", # copy | copy_binary | values | unnest | prepared
+        "INSERT_PAGE_SIZE": "1000", # Filas por envío en modos 'values', 'unnest' y 'prepared'
+        "MAX_WORKERS": str(os.cpu_count() or 1), # Archivos procesados en paralelo
+        "CSV_ENGINE": "csv" # csv | pyarrow
     }
     if os.path.exists(ENV_FILE):
         logging.info(f"Cargando configuración desde {ENV_FILE}")
@@ -60,53 +89,183 @@ DB_NAME = os.getenv("DB_NAME", config["DB_NAME"])
 DB_USER = os.getenv("DB_USER", config["DB_USER"])
 DB_PASS = os.getenv("DB_PASS", config["DB_PASS"])
 
+# Configuración de Inserción
+INSERT_METHOD = os.getenv("INSERT_METHOD", config["INSERT_METHOD"]).strip().lower()
+try:
+    INSERT_PAGE_SIZE = int(os.getenv("INSERT_PAGE_SIZE", config["INSERT_PAGE_SIZE"]))
+except ValueError:
+    INSERT_PAGE_SIZE = 0 # Se informa como inválido en main_loop
+MAX_WORKERS = max(1, int(os.getenv("MAX_WORKERS", config["MAX_WORKERS"])))
+
+# Configuración de Lectura
+CSV_ENGINE = os.getenv("CSV_ENGINE", config["CSV_ENGINE"]).strip().lower()
+
 TABLE_NAME = "lims_backup_historico"
+MAX_IDENTIFIER_BYTES = 63 # PostgreSQL recorta los identificadores más largos (NAMEDATALEN - 1)
+BATCH_ROWS = 1000 # Filas por lote leído del CSV; el primer lote se usa para inferir tipos
+COPY_BUFFER_SIZE = 1 << 16 # Bytes por bloque enviado en COPY
+READ_BUFFER_SIZE = 1 << 20 # Bytes del buffer de lectura del CSV
+POLL_MIN_INTERVAL = 0.1 # Segundos entre revisiones mientras llegan archivos
+POLL_MAX_INTERVAL = 30 # Tope de la espera (backoff exponencial) sin archivos
+RECONCILE_INTERVAL = 60 # Segundos entre revisiones completas del directorio (con watchdog)
+FILE_QUEUE_SIZE = 10000 # Máximo de eventos de archivo en espera
+FILE_SETTLE_SECONDS = 0.5 # Un archivo modificado hace menos que esto aún se está escribiendo
+WORKER_CRASH_RETRIES = 2 # Reintentos de un archivo en curso cuando muere un worker, antes de ir a errores
+
+# Números aceptados por DOUBLE PRECISION (los valores ya vienen sin espacios)
+_NUMERIC_RE = re.compile(r'[-+]?(?:(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?|inf(?:inity)?)', re.IGNORECASE | re.ASCII)
+
+# Reemplazos de un carácter aplicados por clean_name en una sola pasada
+_NAME_TRANS = str.maketrans({' ': '_', '-': '_', '.': '_', '/': '_', '(': '', ')': ''})
+
+# Valores (ya sin espacios) que se cargan como NULL
+_NULLS = frozenset(('', 'N/A', 'n/a', 'NaN', 'nan'))
+
+# Esquemas (hash de columnas) cuyas columnas ya se verificaron en la tabla en este proceso
+_ddl_cache = set()
+
+# Pool de conexiones del proceso (cada worker crea el suyo al primer uso)
+_pool = None
 
 # --- FUNCIONES DE AYUDA ---
 
 def clean_name(name):
-    """Limpia nombres de columnas al estilo Pandas"""
+    """Limpia nombres de columnas al estilo Pandas, recortados como los guarda PostgreSQL"""
     if not name: return "unknown_col"
-    return name.strip().lower()\
-        .replace(' ', '_')\
-        .replace('-', '_')\
-        .replace('.', '_')\
-        .replace('/', '_')\
-        .replace('+', 'plus_')\
-        .replace('(', '')\
-        .replace(')', '')
-
-def parse_value(value):
-    """Limpia y convierte valores básicos"""
-    if value is None:
-        return None
-    v = value.strip()
-    if v in ['', 'N/A', 'n/a', 'NaN', 'nan']:
-        return None
-    return v
+    cleaned = name.strip().lower().replace('+', 'plus_').translate(_NAME_TRANS)
+    # Recorte por bytes sin partir caracteres UTF-8, igual que el servidor, para que
+    # los nombres coincidan con los de la tabla (tipos en COPY binario, columnas faltantes)
+    return cleaned.encode('utf-8')[:MAX_IDENTIFIER_BYTES].decode('utf-8', 'ignore')
 
 def infer_sql_type(header_name, values):
     """Infiere el tipo SQL (TEXT, DOUBLE PRECISION, TIMESTAMP)"""
     if 'date' in header_name or 'time' in header_name:
          return 'TIMESTAMP'
     
-    is_numeric = True
-    has_data = False
+    present = [v for v in values if v is not None]
     
-    for v in values:
-        if v is None:
-            continue
-        has_data = True
-        try:
-            float(v)
-        except ValueError:
-            is_numeric = False
-            break
-            
-    if has_data and is_numeric:
+    if present and all(map(_NUMERIC_RE.fullmatch, present)):
         return 'DOUBLE PRECISION'
     return 'TEXT'
 
+def get_pool():
+    """Devuelve el pool de conexiones de este proceso, creándolo al primer uso"""
+    global _pool
+    if _pool is None:
+        # Un worker procesa un archivo a la vez: basta una conexión (más una de holgura)
+        _pool = ThreadedConnectionPool(
+            1, 2, host=DB_HOST, port=DB_PORT, database=DB_NAME, user=DB_USER, password=DB_PASS
+        )
+    return _pool
+
+def checkout_conn():
+    """Toma una conexión del pool comprobando que siga viva. conn.closed solo se
+    actualiza al usarla, así que una conexión que el servidor cerró mientras estaba
+    inactiva se detecta con una consulta y se reemplaza por una nueva."""
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        conn.rollback()
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        pool.putconn(conn, close=True)
+        conn = pool.getconn()
+    return conn
+
+def schema_key(headers):
+    """Hash de la lista de columnas, usado como clave del caché de esquemas"""
+    return hashlib.blake2b(','.join(headers).encode('utf-8'), digest_size=16).hexdigest()
+
+def load_schema_cache():
+    """Lee el caché de esquemas inferidos: {hash: {"headers": [...], "column_types": [...]}}"""
+    if not os.path.exists(SCHEMA_CACHE_FILE):
+        return {}
+    try:
+        with open(SCHEMA_CACHE_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        logging.warning(f"Advertencia leyendo caché de esquemas: {e}")
+        return {}
+
+def save_schema_cache(cache):
+    """Guarda el caché de esquemas de forma atómica (archivo temporal + reemplazo)"""
+    tmp_path = f"{SCHEMA_CACHE_FILE}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(cache, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, SCHEMA_CACHE_FILE)
+    except Exception as e:
+        logging.warning(f"Advertencia guardando caché de esquemas: {e}")
+
+def store_schema(key, entry):
+    """Agrega un esquema al caché. Solo lo llama el proceso principal: con un único
+    escritor, dos workers que terminan a la vez no se pisan las entradas"""
+    cache = load_schema_cache()
+    cache[key] = entry
+    save_schema_cache(cache)
+
+def get_table_types(cur):
+    """Devuelve {columna: tipo SQL} de la tabla destino tal como existe en la BD"""
+    cur.execute(
+        "SELECT attname, format_type(atttypid, atttypmod) FROM pg_attribute "
+        "WHERE attrelid = to_regclass(quote_ident(%s)) AND attnum > 0 AND NOT attisdropped",
+        (TABLE_NAME,)
+    )
+    return dict(cur.fetchall())
+
+def ensure_table(cur, headers, column_types):
+    """Crea la tabla o agrega las columnas que falten, dentro de la transacción del llamador"""
+    existing = get_table_types(cur)
+    if existing and all(h in existing for h in headers):
+        return
+    
+    # Hay DDL pendiente: se serializa entre workers con un lock consultivo y se
+    # vuelve a leer la tabla, que otro worker pudo crear o ampliar mientras tanto
+    cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (TABLE_NAME,))
+    existing = get_table_types(cur)
+    
+    if not existing:
+        create_query = sql.SQL("CREATE TABLE IF NOT EXISTS {} ({})").format(
+            sql.Identifier(TABLE_NAME),
+            sql.SQL(', ').join(
+                sql.SQL("{} {}").format(sql.Identifier(h), sql.SQL(ctype))
+                for h, ctype in zip(headers, column_types)
+            )
+        )
+        cur.execute(create_query)
+    else:
+        # Evolución de esquema: columnas nuevas en el CSV
+        for h, ctype in zip(headers, column_types):
+            if h in existing:
+                continue
+            cur.execute(sql.SQL("ALTER TABLE {} ADD COLUMN IF NOT EXISTS {} {}").format(
+                sql.Identifier(TABLE_NAME), sql.Identifier(h), sql.SQL(ctype)
+            ))
+            logging.info(f"Columna agregada a {TABLE_NAME}: {h} {ctype}")
+
+def prepare_table():
+    """Crea/actualiza la tabla al iniciar con el esquema más amplio del caché de esquemas.
+    El caché solo guarda esquemas de importaciones exitosas, así que esta DDL corta
+    (confirmada antes de empezar a cargar) nunca fija tipos de un archivo fallido."""
+    widest = {}
+    for entry in load_schema_cache().values():
+        for h, ctype in zip(entry['headers'], entry['column_types']):
+            widest.setdefault(h, ctype)
+    if not widest:
+        return # Sin esquemas conocidos: la tabla la crea el primer archivo
+    
+    conn = psycopg2.connect(
+        host=DB_HOST, port=DB_PORT, database=DB_NAME, user=DB_USER, password=DB_PASS
+    )
+    try:
+        with conn.cursor() as cur:
+            ensure_table(cur, list(widest), list(widest.values()))
+        conn.commit()
+        logging.info(f"Tabla {TABLE_NAME} verificada ({len(widest)} columnas conocidas).")
+    finally:
+        conn.close()
+
 def move_file(file_path, dest_dir):
     try:
         filename = os.path.basename(file_path)
@@ -123,15 +282,306 @@ def move_file(file_path, dest_dir):
     except Exception as e:
         logging.error(f"Error moviendo archivo {file_path}: {e}")
 
+class CsvRowStream:
+    """Expone lotes de columnas como archivo CSV de solo lectura para copy_expert"""
+    def __init__(self, batches):
+        self.batches = iter(batches)
+        self.row_count = 0
+        self._buf = io.StringIO()
+        self._writer = csv.writer(self._buf)
+
+    def read(self, size=-1):
+        while size < 0 or self._buf.tell() < size:
+            columns = next(self.batches, None)
+            if columns is None:
+                break
+            # Las columnas se vuelven filas recién al escribirlas
+            self._writer.writerows(zip(*columns))
+            self.row_count += len(columns[0])
+        data = self._buf.getvalue()
+        self._buf.seek(0)
+        self._buf.truncate()
+        return data
+
+def copy_rows(cur, headers, column_types, batches):
+    """Inserta filas vía COPY FROM STDIN (carga masiva en un solo envío)"""
+    stream = CsvRowStream(batches)
+    
+    copy_query = sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT CSV, NULL '')").format(
+        sql.Identifier(TABLE_NAME),
+        sql.SQL(', ').join(map(sql.Identifier, headers))
+    )
+    cur.copy_expert(copy_query, stream, size=COPY_BUFFER_SIZE)
+    return stream.row_count
+
+# --- COPY binario ---
+# Firma + flags + largo de extensión del formato binario de COPY, y fin de datos
+_PGCOPY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0)
+_PGCOPY_TRAILER = struct.pack('>h', -1)
+_PG_NULL = struct.pack('>i', -1)
+_PG_EPOCH = datetime(2000, 1, 1)
+_pack_double = struct.Struct('>id').pack
+_pack_int64 = struct.Struct('>iq').pack
+# Fecha ISO 8601: YYYY-MM-DD[( |T)HH:MM[:SS[.f]]][Z|±HH[:MM]]
+_ISO_TIMESTAMP_RE = re.compile(
+    r'(\d{4})-(\d{2})-(\d{2})'
+    r'(?:[T ](\d{2}):(\d{2})(?::(\d{2})(?:\.(\d{1,6}))?)?(?:Z|[+-]\d{2}(?::?\d{2})?)?)?',
+    re.ASCII
+)
+
+def _encode_text(v):
+    data = str(v).encode('utf-8')
+    return struct.pack('>i', len(data)) + data
+
+def _encode_double(v):
+    return _pack_double(8, float(v))
+
+def _parse_timestamp(v):
+    """Convierte una fecha ISO 8601 a datetime (sin datetime.fromisoformat, que no existe
+    en Python 3.6 y hasta 3.10 no acepta 'Z' ni fracciones cortas). El huso horario se
+    ignora, igual que al cargar texto en TIMESTAMP WITHOUT TIME ZONE."""
+    m = _ISO_TIMESTAMP_RE.fullmatch(v)
+    if m is None:
+        raise ValueError(f"Fecha no ISO 8601 para COPY binario: '{v}'")
+    year, month, day, hour, minute, second, fraction = m.groups()
+    return datetime(int(year), int(month), int(day), int(hour or 0), int(minute or 0),
+                    int(second or 0), int((fraction or '0').ljust(6, '0')))
+
+def _encode_timestamp(v):
+    # El formato binario no acepta texto: las fechas deben venir en ISO 8601
+    if not isinstance(v, datetime):
+        v = _parse_timestamp(v)
+    delta = v.replace(tzinfo=None) - _PG_EPOCH
+    return _pack_int64(8, (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds)
+
+# Codificadores por tipo (nombres según format_type, ver get_table_types)
+BINARY_ENCODERS = {
+    'text': _encode_text,
+    'double precision': _encode_double,
+    'timestamp without time zone': _encode_timestamp,
+}
+
+class BinaryRowStream:
+    """Expone lotes de columnas en el formato binario de COPY para copy_expert"""
+    def __init__(self, batches, encoders):
+        self.batches = iter(batches)
+        self.encoders = encoders
+        self.row_count = 0
+        self._tuple_header = struct.pack('>h', len(encoders))
+        self._chunks = [_PGCOPY_HEADER]
+        self._done = False
+
+    def read(self, size=-1):
+        while not self._done and (size < 0 or sum(map(len, self._chunks)) < size):
+            columns = next(self.batches, None)
+            if columns is None:
+                self._chunks.append(_PGCOPY_TRAILER)
+                self._done = True
+                break
+            # Se codifica columna por columna y se arma cada fila al final
+            encoded = [
+                [_PG_NULL if v is None else encode(v) for v in col]
+                for encode, col in zip(self.encoders, columns)
+            ]
+            header = self._tuple_header
+            self._chunks.append(b''.join(header + b''.join(fields) for fields in zip(*encoded)))
+            self.row_count += len(columns[0])
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def copy_rows_binary(cur, headers, column_types, batches):
+    """Inserta filas vía COPY FROM STDIN en formato binario (sin parseo de texto en el servidor)"""
+    # El formato binario exige el tipo exacto de cada columna en la tabla
+    table_types = get_table_types(cur)
+    encoders = []
+    for h in headers:
+        encoder = BINARY_ENCODERS.get(table_types.get(h))
+        if encoder is None:
+            raise Exception(f"COPY binario no soporta el tipo '{table_types.get(h)}' de la columna {h}.")
+        encoders.append(encoder)
+    
+    stream = BinaryRowStream(batches, encoders)
+    copy_query = sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT BINARY)").format(
+        sql.Identifier(TABLE_NAME),
+        sql.SQL(', ').join(map(sql.Identifier, headers))
+    )
+    cur.copy_expert(copy_query, stream, size=COPY_BUFFER_SIZE)
+    return stream.row_count
+
+def repage(batches, page_rows):
+    """Reagrupa los lotes de columnas en páginas de page_rows filas, cruzando los
+    límites entre lotes (INSERT_PAGE_SIZE puede ser mayor o menor que BATCH_ROWS)"""
+    partial = None # Página incompleta arrastrada desde el lote anterior
+    for columns in batches:
+        n = len(columns[0])
+        start = 0
+        if partial is not None:
+            start = min(n, page_rows - len(partial[0]))
+            for acc, col in zip(partial, columns):
+                acc.extend(col[:start])
+            if len(partial[0]) < page_rows:
+                continue
+            yield partial
+            partial = None
+        elif n == page_rows:
+            yield columns # Lote justo del tamaño de la página: sin copiar
+            continue
+        while n - start >= page_rows:
+            yield [col[start:start + page_rows] for col in columns]
+            start += page_rows
+        if start < n:
+            partial = [col[start:] for col in columns]
+    if partial is not None:
+        yield partial
+
+def param_columns(headers):
+    """Lista de columnas para consultas con parámetros: psycopg2 aplica formato % a
+    toda la consulta, así que los '%' de los nombres (p. ej. %rsd) se escapan como '%%'"""
+    return sql.SQL(', ').join(sql.Identifier(h.replace('%', '%%')) for h in headers)
+
+def insert_values(cur, headers, column_types, batches):
+    """Inserta filas con INSERT multi-VALUES por páginas (alternativa a COPY)"""
+    insert_query = sql.SQL("INSERT INTO {} ({}) VALUES %s").format(
+        sql.Identifier(TABLE_NAME),
+        param_columns(headers)
+    )
+    row_count = 0
+    for columns in repage(batches, INSERT_PAGE_SIZE):
+        execute_values(cur, insert_query, zip(*columns), page_size=INSERT_PAGE_SIZE)
+        row_count += len(columns[0])
+    return row_count
+
+def insert_unnest(cur, headers, column_types, batches):
+    """Inserta filas con INSERT ... SELECT FROM unnest(), un arreglo por columna"""
+    # Los arreglos se castean al tipo real de cada columna en la tabla: el inferido
+    # para este archivo puede diferir (p. ej. TEXT si la muestra venía vacía)
+    table_types = get_table_types(cur)
+    casts = sql.SQL(', ').join(
+        sql.SQL('%s::{}[]').format(sql.SQL(table_types.get(h, ctype)))
+        for h, ctype in zip(headers, column_types)
+    )
+    insert_query = sql.SQL("INSERT INTO {} ({}) SELECT * FROM unnest({})").format(
+        sql.Identifier(TABLE_NAME),
+        param_columns(headers),
+        casts
+    )
+    row_count = 0
+    # Las páginas ya vienen como una lista por columna: se envían tal cual
+    for columns in repage(batches, INSERT_PAGE_SIZE):
+        cur.execute(insert_query, columns)
+        row_count += len(columns[0])
+    return row_count
+
+def insert_prepared(cur, headers, column_types, batches):
+    """Inserta filas con una sentencia preparada (PREPARE una vez, EXECUTE por fila)"""
+    # Los parámetros se declaran con el tipo real de cada columna en la tabla
+    table_types = get_table_types(cur)
+    prepare_query = sql.SQL("PREPARE lims_ins ({}) AS INSERT INTO {} ({}) VALUES ({})").format(
+        sql.SQL(', ').join(sql.SQL(table_types.get(h, ctype)) for h, ctype in zip(headers, column_types)),
+        sql.Identifier(TABLE_NAME),
+        sql.SQL(', ').join(map(sql.Identifier, headers)),
+        sql.SQL(', ').join(sql.SQL(f"${i + 1}") for i in range(len(headers)))
+    )
+    execute_query = "EXECUTE lims_ins ({})".format(', '.join(['%s'] * len(headers)))
+    
+    cur.execute(prepare_query)
+    row_count = 0
+    for columns in repage(batches, INSERT_PAGE_SIZE):
+        # execute_batch agrupa varios EXECUTE por envío al servidor
+        execute_batch(cur, execute_query, zip(*columns), page_size=INSERT_PAGE_SIZE)
+        row_count += len(columns[0])
+    cur.execute("DEALLOCATE lims_ins")
+    return row_count
+
+INSERT_METHODS = {
+    'copy': copy_rows,
+    'copy_binary': copy_rows_binary,
+    'values': insert_values,
+    'unnest': insert_unnest,
+    'prepared': insert_prepared,
+}
+
+# Plantilla del lector de lotes especializado por número de columnas: cada
+# celda se limpia con una línea propia, sin zip/map ni bucle interno genérico
+_BATCH_READER_TEMPLATE = """
+def read_batch(reader, batch_rows, _NULLS=_NULLS):
+{init}
+    pad = [''] * {num_cols}
+    n = 0
+    for row in reader:
+        if not row: continue
+        # Rellenar (las columnas sobrantes se ignoran)
+        if len(row) < {num_cols}:
+            row += pad[len(row):]
+{cells}
+        n += 1
+        if n == batch_rows:
+            break
+    return n, [{columns}]
+"""
+
+# Lectores ya generados, por número de columnas
+_batch_readers = {}
+
+def make_batch_reader(num_cols):
+    """Genera (una vez por número de columnas) la función que lee un lote en columnas"""
+    read_batch = _batch_readers.get(num_cols)
+    if read_batch is None:
+        src = _BATCH_READER_TEMPLATE.format(
+            num_cols=num_cols,
+            init='\n'.join(f"    c{i} = []; a{i} = c{i}.append" for i in range(num_cols)),
+            cells='\n'.join(
+                f"        v = row[{i}].strip(); a{i}(None if v in _NULLS else v)" for i in range(num_cols)
+            ),
+            columns=', '.join(f"c{i}" for i in range(num_cols))
+        )
+        namespace = {'_NULLS': _NULLS}
+        exec(src, namespace)
+        read_batch = _batch_readers[num_cols] = namespace['read_batch']
+    return read_batch
+
+def csv_column_batches(reader, num_cols, batch_rows):
+    """Lee filas limpias (rellenadas/recortadas) directamente en columnas, por lotes"""
+    read_batch = make_batch_reader(num_cols)
+    while True:
+        n, columns = read_batch(reader, batch_rows)
+        if not n:
+            return
+        yield n, columns
+
+def arrow_column_batches(file_path, num_cols):
+    """Lee las columnas de datos por lotes con el lector CSV (C++, multihilo) de PyArrow"""
+    # Todo se lee como texto para conservar las reglas de limpieza e inferencia
+    names = [f"c{i}" for i in range(num_cols)]
+    batches = pa_csv.open_csv(
+        file_path,
+        read_options=pa_csv.ReadOptions(skip_rows=1, column_names=names, block_size=READ_BUFFER_SIZE),
+        convert_options=pa_csv.ConvertOptions(column_types={n: pa.string() for n in names})
+    )
+    for batch in batches:
+        if batch.num_rows:
+            yield batch.num_rows, [
+                [None if v in _NULLS else v for v in map(str.strip, col.to_pylist())]
+                for col in batch.columns
+            ]
+
+def with_metadata(batches, filename, now):
+    """Añade a cada lote las columnas de metadata (source_filename, import_timestamp)"""
+    for n, columns in batches:
+        columns.append([filename] * n)
+        columns.append([now] * n)
+        yield columns
+
 def process_file(file_path):
+    """Importa un CSV. Devuelve (éxito, esquema nuevo para el caché como (hash, entrada) o None)"""
     logging.info(f"--- Procesando archivo: {file_path} ---")
     conn = None
+    conn_ok = False
     try:
-        # 1. Leer CSV
-        raw_data = []
-        headers = []
-        
-        with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+        # 1. Leer CSV (en streaming, por lotes de columnas: solo se retiene la muestra)
+        with open(file_path, 'r', encoding='utf-8', errors='replace',
+                  newline='', buffering=READ_BUFFER_SIZE) as f:
             reader = csv.reader(f)
             try:
                 original_headers = next(reader)
@@ -147,117 +597,289 @@ def process_file(file_path):
             filename = os.path.basename(file_path)
             now = datetime.now()
             
-            for row in reader:
-                if not row: continue
-                # Rellenar o recortar
-                if len(row) < len(original_headers):
-                     row += [None] * (len(original_headers) - len(row))
-                
-                cleaned_row = [parse_value(val) for val in row[:len(original_headers)]]
-                
-                # Metadata
-                cleaned_row.append(filename)
-                cleaned_row.append(now)
-                
-                raw_data.append(cleaned_row)
+            num_data_cols = len(original_headers) # Excluyendo metadata
+            if CSV_ENGINE == 'pyarrow':
+                batches = arrow_column_batches(file_path, num_data_cols)
+            else:
+                batches = csv_column_batches(reader, num_data_cols, BATCH_ROWS)
+            batches = with_metadata(batches, filename, now)
+            sample = next(batches, None)
 
-        if not raw_data:
-            raise Exception("No hay datos válidos en el archivo.")
+            if sample is None:
+                raise Exception("No hay datos válidos en el archivo.")
 
-        # 2. Conectar a BD
-        try:
-            conn = psycopg2.connect(
-                host=DB_HOST, port=DB_PORT, database=DB_NAME, user=DB_USER, password=DB_PASS
-            )
-        except Exception as e:
-            logging.error("Error de conexión a BD. Verifique credenciales.", exc_info=False)
-            raise e
-
-        # 3. Inferir Tipos
-        num_data_cols = len(original_headers) # Excluyendo metadata
-        columns_data = [[] for _ in range(num_data_cols)]
-        for row in raw_data:
-            for i in range(num_data_cols):
-                columns_data[i].append(row[i])
-        
-        column_types = []
-        for i, h in enumerate(headers):
-            if h == 'source_filename':
-                column_types.append('TEXT')
-            elif h == 'import_timestamp':
-                column_types.append('TIMESTAMP')
-            else:
-                if i < num_data_cols:
-                    column_types.append(infer_sql_type(h, columns_data[i]))
-                else:
-                    column_types.append('TEXT')
+            # 2. Conectar a BD (conexión reutilizada del pool del proceso)
+            try:
+                conn = checkout_conn()
+            except Exception as e:
+                logging.error("Error de conexión a BD. Verifique credenciales.", exc_info=False)
+                raise e
 
-        # 4. Operaciones SQL
-        with conn.cursor() as cur:
-            # Crear tabla si no existe
-            col_defs = []
-            for h, ctype in zip(headers, column_types):
-                col_defs.append(f"{h} {ctype}")
+            # 3. Inferir Tipos (sobre la muestra), salvo que el esquema ya esté en caché
+            key = schema_key(headers)
+            cached = load_schema_cache().get(key)
             
-            create_query = f"CREATE TABLE IF NOT EXISTS {TABLE_NAME} ({', '.join(col_defs)});"
-            cur.execute(create_query)
-            
-            # Insertar
-            placeholders = ', '.join(['%s'] * len(headers))
-            insert_query = sql.SQL("INSERT INTO {} VALUES ({})").format(
-                sql.Identifier(TABLE_NAME),
-                sql.SQL(placeholders)
-            )
+            if cached and cached.get('headers') == headers:
+                column_types = cached['column_types']
+                logging.info(f"Esquema en caché ({key}), se omite la inferencia de tipos.")
+            else:
+                cached = None
+                
+                column_types = []
+                for i, h in enumerate(headers):
+                    if h == 'source_filename':
+                        column_types.append('TEXT')
+                    elif h == 'import_timestamp':
+                        column_types.append('TIMESTAMP')
+                    else:
+                        if i < num_data_cols:
+                            column_types.append(infer_sql_type(h, sample[i]))
+                        else:
+                            column_types.append('TEXT')
+
+            # 4. Operaciones SQL
+            # Crear tabla / agregar columnas (una vez por esquema en este proceso), ya con
+            # la muestra leída y sus tipos inferidos. Va en una transacción corta propia:
+            # el ACCESS EXCLUSIVE del ALTER y el lock consultivo se liberan antes de la
+            # carga, sin bloquear a los demás workers ni a los lectores durante el COPY.
+            # Las columnas nuevas admiten NULL, así que dejarlas aunque la carga falle
+            # después es inofensivo.
+            if key not in _ddl_cache:
+                with conn.cursor() as cur:
+                    ensure_table(cur, headers, column_types)
+                conn.commit()
+                _ddl_cache.add(key)
             
-            cur.executemany(insert_query, raw_data)
+            with conn.cursor() as cur:
+                # Carga masiva: no esperar el fsync del WAL al hacer commit.
+                # Ante una caída del servidor se pueden perder las últimas transacciones
+                # confirmadas (nunca se corrompen); el CSV queda en lims_processed/ y
+                # puede reimportarse.
+                cur.execute("SET LOCAL synchronous_commit = OFF")
+
+                # Insertar (muestra + resto del archivo, leído a medida que se envía)
+                row_count = INSERT_METHODS[INSERT_METHOD](cur, headers, column_types, chain([sample], batches))
             
         conn.commit()
-        logging.info(f"Importación exitosa: {len(raw_data)} filas.")
-        return True # Success
+        conn_ok = True
+        logging.info(f"Importación exitosa: {row_count} filas.")
+        
+        # Solo se guardan esquemas que lograron importarse; el caché lo escribe el
+        # proceso principal (ver store_schema)
+        if cached:
+            return True, None # Success
+        return True, (key, {'headers': headers, 'column_types': column_types}) # Success
 
     except Exception as e:
         logging.error(f"ERROR PROCESANDO {file_path}: {e}", exc_info=True)
-        if conn: conn.rollback()
-        return False # Failure
+        if conn and not conn.closed: conn.rollback()
+        return False, None # Failure
         
     finally:
-        if conn: conn.close()
+        # Tras un error la conexión se descarta (puede estar rota o con estado de sesión)
+        if conn: get_pool().putconn(conn, close=not conn_ok)
+
+def scan_input_dir():
+    """Lista los archivos (no ocultos) presentes en INPUT_DIR"""
+    with os.scandir(INPUT_DIR) as it:
+        return [e.path for e in it if e.is_file() and not e.name.startswith('.')]
+
+class InputDirHandler(FileSystemEventHandler):
+    """Encola las rutas de archivos que aparecen o terminan de escribirse en INPUT_DIR"""
+    def __init__(self, file_queue):
+        super().__init__()
+        self.file_queue = file_queue
+
+    def enqueue(self, path):
+        if os.path.dirname(path) != INPUT_DIR or os.path.basename(path).startswith('.'):
+            return
+        try:
+            self.file_queue.put_nowait(path)
+        except queue.Full:
+            pass # La revisión periódica lo encontrará
+
+    def on_created(self, event):
+        if not event.is_directory: self.enqueue(event.src_path)
+
+    def on_modified(self, event):
+        if not event.is_directory: self.enqueue(event.src_path)
+
+    def on_closed(self, event): # IN_CLOSE_WRITE (solo Linux)
+        if not event.is_directory: self.enqueue(event.src_path)
+
+    def on_moved(self, event):
+        if not event.is_directory: self.enqueue(event.dest_path)
+
+def move_finished(pending, crashes):
+    """Mueve los archivos cuyo procesamiento terminó según su resultado y guarda en el
+    caché los esquemas nuevos. Devuelve True si algún worker murió (pool de procesos roto)."""
+    broken = False
+    for future in [f for f in pending if f.done()]:
+        file_path = pending.pop(future)
+        new_schema = None
+        try:
+            ok, new_schema = future.result()
+        except BrokenProcessPool:
+            # No se sabe cuál de los archivos en curso (a lo más MAX_WORKERS) mató al
+            # worker: se cuentan todos y se reintentan, hasta que uno supere WORKER_CRASH_RETRIES
+            broken = True
+            crashes[file_path] = crashes.get(file_path, 0) + 1
+            if crashes[file_path] <= WORKER_CRASH_RETRIES:
+                continue # Sigue en INPUT_DIR
+            logging.error(f"{file_path} estaba en curso en {crashes[file_path]} caídas de worker, se envía a errores.")
+            ok = False
+        except Exception as e:
+            logging.error(f"ERROR PROCESANDO {file_path}: {e}")
+            ok = False
+        except BaseException as e:
+            # KeyboardInterrupt en el worker (Ctrl+C llega a todo el grupo de procesos):
+            # el archivo no terminó y queda en INPUT_DIR; se sigue con los demás
+            logging.warning(f"{file_path} interrumpido ({type(e).__name__}), queda en {INPUT_DIR}.")
+            continue
+        crashes.pop(file_path, None)
+        if new_schema:
+            store_schema(*new_schema)
+        if ok:
+            move_file(file_path, PROCESSED_DIR)
+        else:
+            move_file(file_path, ERRORS_DIR)
+    return broken
 
 def main_loop():
     logging.info(f"Iniciando monitoreo en: {INPUT_DIR}")
     logging.info(f"Salida procesados: {PROCESSED_DIR}")
     logging.info(f"Salida errores: {ERRORS_DIR}")
     
+    if INSERT_METHOD not in INSERT_METHODS:
+        logging.error(f"INSERT_METHOD inválido: '{INSERT_METHOD}'. Opciones: {', '.join(INSERT_METHODS)}")
+        return
+    logging.info(f"Método de inserción: {INSERT_METHOD}")
+    
+    if INSERT_PAGE_SIZE < 1:
+        logging.error(f"INSERT_PAGE_SIZE inválido: '{os.getenv('INSERT_PAGE_SIZE', config['INSERT_PAGE_SIZE'])}'. Debe ser un entero mayor o igual a 1")
+        return
+    
+    if CSV_ENGINE not in ('csv', 'pyarrow'):
+        logging.error(f"CSV_ENGINE inválido: '{CSV_ENGINE}'. Opciones: csv, pyarrow")
+        return
+    if CSV_ENGINE == 'pyarrow' and pa_csv is None:
+        logging.error("CSV_ENGINE=pyarrow requiere el paquete pyarrow (pip install pyarrow).")
+        return
+    logging.info(f"Lector CSV: {CSV_ENGINE}")
+    logging.info(f"Procesos en paralelo: {MAX_WORKERS}")
+    
     # Asegurar directorios
+    os.makedirs(INPUT_DIR, exist_ok=True)
     os.makedirs(PROCESSED_DIR, exist_ok=True)
     os.makedirs(ERRORS_DIR, exist_ok=True)
     
-    while True:
+    # La DDL se resuelve aquí, fuera del camino de carga de los workers
+    try:
+        prepare_table()
+    except Exception as e:
+        logging.error(f"Error preparando la tabla {TABLE_NAME}: {e}")
+    
+    # Eventos del sistema de archivos (si watchdog está instalado) + revisión
+    # periódica del directorio para lo que llegó antes de iniciar o se perdió
+    file_queue = queue.Queue(maxsize=FILE_QUEUE_SIZE)
+    observer = None
+    if Observer is not None:
         try:
-            files = [f for f in os.listdir(INPUT_DIR) if os.path.isfile(os.path.join(INPUT_DIR, f))]
-            
-            for file_name in files:
-                file_path = os.path.join(INPUT_DIR, file_name)
+            observer = Observer()
+            observer.schedule(InputDirHandler(file_queue), INPUT_DIR, recursive=False)
+            observer.start()
+            logging.info(f"Monitoreo por eventos (watchdog), revisión completa cada {RECONCILE_INTERVAL}s")
+        except OSError as e:
+            # P. ej. límite de inotify alcanzado o sistema de archivos de red sin eventos
+            logging.error(f"No se pudo iniciar watchdog ({e}): monitoreo por sondeo del directorio")
+            observer = None
+    else:
+        logging.info("watchdog no instalado: monitoreo por sondeo del directorio")
+    
+    # Cada archivo es independiente (abre su propia conexión), así que se
+    # procesan en paralelo; los archivos se mueven desde el proceso principal
+    executor = ProcessPoolExecutor(max_workers=MAX_WORKERS)
+    pending = {} # future -> ruta del archivo
+    ready = {} # Archivos listos que esperan un worker libre (dict como conjunto ordenado)
+    crashes = {} # ruta del archivo -> caídas de worker con el archivo en curso
+    settling = set() # Archivos recién modificados, a revisar en la próxima vuelta
+    delay = POLL_MIN_INTERVAL
+    next_scan = 0.0
+    try:
+        while True:
+            try:
+                candidates = list(settling)
+                settling.clear()
+                try:
+                    candidates.append(file_queue.get(timeout=delay))
+                    while True:
+                        candidates.append(file_queue.get_nowait())
+                except queue.Empty:
+                    pass
                 
-                if file_name.startswith('.'):
-                    continue
+                if observer is None or time.monotonic() >= next_scan:
+                    candidates.extend(scan_input_dir())
+                    next_scan = time.monotonic() + RECONCILE_INTERVAL
                 
-                time.sleep(1) 
+                in_flight = set(pending.values())
+                for file_path in dict.fromkeys(candidates):
+                    if file_path in in_flight or file_path in ready:
+                        continue
+                    try:
+                        mtime = os.path.getmtime(file_path)
+                    except OSError:
+                        continue # Ya no existe (movido o borrado)
+                    if time.time() - mtime < FILE_SETTLE_SECONDS:
+                        settling.add(file_path)
+                        continue
+                    ready[file_path] = None
                 
-                success = process_file(file_path)
+                if move_finished(pending, crashes):
+                    raise BrokenProcessPool("un worker terminó abruptamente")
                 
-                if success:
-                    move_file(file_path, PROCESSED_DIR)
+                # A lo más MAX_WORKERS archivos en el pool; el resto espera aquí. Así una
+                # caída de worker solo cuenta los archivos que de verdad estaban en curso,
+                # y al detener el servicio no se espera a que termine toda la cola
+                while ready and len(pending) < MAX_WORKERS:
+                    file_path = next(iter(ready))
+                    del ready[file_path]
+                    if os.path.exists(file_path):
+                        pending[executor.submit(process_file, file_path)] = file_path
+                
+                # Con trabajo pendiente se vuelve a revisar enseguida. Sin trabajo:
+                # con eventos se espera hasta la próxima revisión completa; con
+                # sondeo la espera se duplica hasta POLL_MAX_INTERVAL
+                if pending or ready or settling or (observer is None and candidates):
+                    delay = POLL_MIN_INTERVAL
+                elif observer is not None:
+                    delay = max(POLL_MIN_INTERVAL, next_scan - time.monotonic())
                 else:
-                    move_file(file_path, ERRORS_DIR)
-                    
-        except KeyboardInterrupt:
-            logging.info("Deteniendo servicio...")
-            break
+                    delay = min(POLL_MAX_INTERVAL, max(1, delay * 2))
+                        
+            except KeyboardInterrupt:
+                logging.info("Deteniendo servicio...")
+                break
+            except BrokenProcessPool as e:
+                # Primero se mueven los archivos ya confirmados (para no reimportarlos);
+                # los que estaban en curso siguen en INPUT_DIR y se reintentan
+                logging.error(f"Pool de procesos detenido, reiniciando: {e}")
+                wait(pending)
+                move_finished(pending, crashes)
+                executor.shutdown(wait=False)
+                executor = ProcessPoolExecutor(max_workers=MAX_WORKERS)
+                next_scan = 0.0
+            except Exception as e:
+                logging.error(f"Error en ciclo principal: {e}")
+                delay = min(POLL_MAX_INTERVAL, max(1, delay * 2))
+    finally:
+        if observer is not None:
+            observer.stop()
+            observer.join()
+        executor.shutdown()
+        try:
+            move_finished(pending, crashes)
         except Exception as e:
-            logging.error(f"Error en ciclo principal: {e}")
-        
-        time.sleep(5)
+            logging.error(f"Error moviendo archivos al detener: {e}")
 
 if __name__ == "__main__":
     main_loop()